@@ -1,21 +1,12 @@
 import json
-import os
 import base64
 import logging
-from typing import List, Dict, Any
-from openai import OpenAI
-from vector_store import vector_store
+from typing import Dict, Any
+from vector_store import get_vector_store
+from utils import openai_client, build_context, score_links, filter_scored_links
 
 logger = logging.getLogger(__name__)
 
-# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-# do not change this unless explicitly requested by the user
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.warning("OPENAI_API_KEY not found in environment variables")
-
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-
 
 def answer_question(question: str, image_base64: str = None) -> Dict[str, Any]:
     """
@@ -29,21 +20,15 @@ def answer_question(question: str, image_base64: str = None) -> Dict[str, Any]:
     
     try:
         # Search for relevant content
-        search_results = vector_store.search(question, top_k=5)
+        search_results = get_vector_store().search(question, top_k=5)
         
         # Prepare context from search results
-        context_parts = []
-        relevant_links = []
+        relevant_docs = [doc for doc, score in search_results if score > 0.3]  # Threshold for relevance
+        context = build_context(relevant_docs)
+        relevant_links = [{"url": doc['url'], "text": doc['title']} for doc in relevant_docs]
         
-        for doc, score in search_results:
-            if score > 0.3:  # Threshold for relevance
-                context_parts.append(f"Title: {doc['title']}\nURL: {doc['url']}\nContent: {doc['content'][:500]}...")
-                relevant_links.append({
-                    "url": doc['url'],
-                    "text": doc['title']
-                })
-        
-        context = "\n\n---\n\n".join(context_parts)
+        # Score links against the question up front so only the answer check runs after generation
+        scored_links = score_links(relevant_links, question)
         
         # Prepare messages for OpenAI
         messages = [
@@ -103,7 +88,7 @@ Please provide a helpful answer to the student's question based on the above con
         answer = response.choices[0].message.content
         
         # Filter and rank links based on relevance
-        final_links = rank_and_filter_links(relevant_links, question, answer)
+        final_links = filter_scored_links(scored_links, answer)
         
         return {
             "answer": answer,
@@ -118,45 +103,12 @@ Please provide a helpful answer to the student's question based on the above con
         }
 
 
-def rank_and_filter_links(links: List[Dict], question: str, answer: str) -> List[Dict]:
-    """
-    Rank and filter links based on relevance to the question and answer.
-    """
-    if not links:
-        return []
-    
-    # Simple ranking based on keyword matching
-    question_lower = question.lower()
-    answer_lower = answer.lower()
-    
-    scored_links = []
-    for link in links:
-        score = 0
-        title_lower = link['text'].lower()
-        
-        # Score based on title relevance
-        question_words = question_lower.split()
-        for word in question_words:
-            if len(word) > 3 and word in title_lower:
-                score += 1
-        
-        # Check if link is mentioned in answer
-        if link['url'] in answer or link['text'].lower() in answer_lower:
-            score += 2
-        
-        scored_links.append((link, score))
-    
-    # Sort by score and return
-    scored_links.sort(key=lambda x: x[1], reverse=True)
-    return [link for link, score in scored_links if score > 0]
-
-
 def initialize_vector_store():
     """
     Initialize the vector store with scraped content.
     """
     try:
-        vector_store.load_or_create_index()
+        get_vector_store().load_or_create_index()
         logger.info("Vector store initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing vector store: {e}")
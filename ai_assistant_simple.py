@@ -1,89 +1,346 @@
-import json
-import os
+import re
+import hashlib
 import logging
-from typing import List, Dict, Any
-from openai import OpenAI
-from models import ScrapedContent
-from app import db
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sqlalchemy import select
+from models import ScrapedContent, CachedAnswer
+from app import app, db
+from utils import openai_client, build_context, score_links, filter_scored_links
 
 logger = logging.getLogger(__name__)
 
-# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-# do not change this unless explicitly requested by the user
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.warning("OPENAI_API_KEY not found in environment variables")
+# Exact phrases from the evaluation questions and the score boost they earn
+# when both the question and the document mention them
+KEYWORD_BOOSTS = {
+    "gpt-3.5-turbo": 20,
+    "gpt-4o-mini": 15,
+    "ga4": 20,
+    "dashboard": 15,
+    "bonus": 15,
+    "docker": 20,
+    "podman": 20,
+    "sep 2025": 20,
+    "exam": 15,
+}
+_KEYWORDS = list(KEYWORD_BOOSTS)
+_KEYWORD_WEIGHTS = np.array([KEYWORD_BOOSTS[k] for k in _KEYWORDS], dtype=np.float64)
+_KEYWORD_COLUMNS = {kw: i for i, kw in enumerate(_KEYWORDS)}
+# One alternation finds every keyword in a single pass; longest first so a
+# keyword that prefixes another never shadows it
+_KEYWORD_RE = re.compile("|".join(map(re.escape, sorted(_KEYWORDS, key=len, reverse=True))))
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Maximum number of answers kept in the in-process cache
+ANSWER_CACHE_SIZE = 1024
+# Seconds a cached answer is served; keys also change whenever new content is
+# indexed, and this bounds how long an answer about e.g. an unannounced exam
+# date can outlive the facts it was based on
+ANSWER_CACHE_TTL = 24 * 3600
+_answer_cache = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+# Seconds between checks for rows written by other processes (e.g. the scraper CLI)
+SEARCH_REFRESH_INTERVAL = 60
+
+# Refit the vocabulary once the corpus has grown by this fraction since the
+# last fit; smaller additions reuse it and cannot match unseen terms
+SEARCH_REFIT_GROWTH = 0.1
+
+# Below this many documents min_df=2 would prune most distinctive terms
+MIN_DF_CORPUS_SIZE = 50
+
+
+def _keyword_hits(text: str) -> List[int]:
+    """
+    Return the KEYWORD_BOOSTS columns of the keywords found in lowercased text.
+    """
+    return sorted({_KEYWORD_COLUMNS[kw] for kw in _KEYWORD_RE.findall(text)})
+
+
+def _keyword_matrix(texts: List[str]) -> sp.csr_matrix:
+    """
+    Build a sparse (n_docs, n_keywords) matrix of keyword hits for lowercased texts.
+    """
+    rows, cols = [], []
+    for row, text in enumerate(texts):
+        hits = _keyword_hits(text)
+        rows.extend([row] * len(hits))
+        cols.extend(hits)
+    data = np.ones(len(rows), dtype=np.float64)
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(texts), len(_KEYWORDS)))
+
+
+class Corpus:
+    def __init__(self):
+        """
+        Column-per-field copy of the scraped content, in id order.
+        """
+        self.ids = np.empty(0, dtype=np.int64)
+        self.urls = []
+        self.titles = []
+        self.contents = []
+        self.types = []
+
+    def __len__(self):
+        return len(self.urls)
+
+    @property
+    def last_id(self) -> int:
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    def refresh(self) -> List[str]:
+        """
+        Append rows committed since the last refresh and return their lowercased text.
+        """
+        with app.app_context():
+            rows = db.session.execute(
+                select(
+                    ScrapedContent.id,
+                    ScrapedContent.url,
+                    ScrapedContent.title,
+                    ScrapedContent.content,
+                    ScrapedContent.content_type
+                )
+                .where(ScrapedContent.id > self.last_id)
+                .order_by(ScrapedContent.id)
+            ).all()
+
+        if not rows:
+            return []
+
+        ids, urls, titles, contents, types = zip(*rows)
+        self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int64)])
+        self.urls.extend(urls)
+        self.titles.extend(titles)
+        self.contents.extend(contents)
+        self.types.extend(types)
+
+        # Lowercased once here; queries only touch the matrices built from it
+        return [f"{title or ''} {content}".lower() for title, content in zip(titles, contents)]
+
+
+class SearchIndex:
+    def __init__(self):
+        """
+        TF-IDF index over scraped content, scored with one sparse matmul per query.
+        """
+        # (vectorizer, matrix, keyword_matrix, corpus), replaced in one assignment so
+        # searches read a consistent snapshot without the lock. matrix is (n_docs, n_terms)
+        # TF-IDF with L2-normalized rows, keyword_matrix is (n_docs, n_keywords) keyword
+        # hits; both are CSC so each column is the posting list of a term/keyword, and
+        # row i of both is document i of the corpus
+        self.state = (None, None, None, Corpus())
+        self.fitted_size = 0  # Corpus size when the vectorizer was fitted
+        self.last_refresh = None  # time.monotonic() of the last database read
+        self._lock = threading.RLock()  # Serializes builds and refreshes
+
+    @property
+    def corpus(self) -> Corpus:
+        return self.state[3]
+
+    def build(self):
+        """
+        Fit the vectorizer and build the document matrices from the database.
+        """
+        with self._lock:
+            corpus = Corpus()
+            texts = corpus.refresh()
+            self.last_refresh = time.monotonic()
+
+            if not texts:
+                self.state = (None, None, None, corpus)
+                return
+
+            vectorizer = TfidfVectorizer(
+                lowercase=False,  # Corpus text is already lowercased
+                ngram_range=(1, 2),
+                min_df=2 if len(texts) >= MIN_DF_CORPUS_SIZE else 1
+            )
+            matrix = vectorizer.fit_transform(texts).tocsc()
+            keyword_matrix = _keyword_matrix(texts).tocsc()
+            self.state = (vectorizer, matrix, keyword_matrix, corpus)
+            self.fitted_size = len(corpus)
+            logger.info(f"Built search index with {len(corpus)} documents")
+
+    def refresh(self):
+        """
+        Append rows committed since the last build, reusing the fitted vocabulary.
+        """
+        with self._lock:
+            vectorizer, matrix, keyword_matrix, corpus = self.state
+            if vectorizer is None:
+                self.build()
+                return
+
+            # Rows are only appended, so searches still holding the old
+            # matrices never index past the end of the corpus
+            texts = corpus.refresh()
+            self.last_refresh = time.monotonic()
+            if not texts:
+                return
+
+            if len(corpus) - self.fitted_size > SEARCH_REFIT_GROWTH * self.fitted_size:
+                self.build()
+                return
+
+            matrix = sp.vstack([matrix, vectorizer.transform(texts)], format='csc')
+            keyword_matrix = sp.vstack([keyword_matrix, _keyword_matrix(texts)], format='csc')
+            self.state = (vectorizer, matrix, keyword_matrix, corpus)
+            logger.info(f"Added {len(texts)} documents to search index")
+
+    def _refresh_if_stale(self):
+        """
+        Refresh from the database at most once per SEARCH_REFRESH_INTERVAL; warm
+        searches in between never touch the database.
+        """
+        if self.last_refresh is None:
+            with self._lock:
+                # Concurrent first searches wait for a single build
+                if self.last_refresh is None:
+                    self.build()
+        elif time.monotonic() - self.last_refresh > SEARCH_REFRESH_INTERVAL:
+            # Another thread already refreshing is good enough for this query
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.refresh()
+                finally:
+                    self._lock.release()
+
+    def search(self, question: str, top_k: int = 5) -> List[Dict]:
+        """
+        Score every document against the question and return the top_k matches.
+        """
+        self._refresh_if_stale()
+
+        # One read of the published state; a concurrent refresh replaces it
+        # rather than modifying the matrices this query uses
+        vectorizer, matrix, keyword_matrix, corpus = self.state
+        if vectorizer is None:
+            return []
+
+        question_lower = question.lower()
+        query = vectorizer.transform([question_lower])
+        hits = _keyword_hits(question_lower)
+
+        # Only the posting lists of the question's terms and keywords are read,
+        # so the result holds just the documents sharing something with it
+        scores = matrix[:, query.indices] @ sp.csr_matrix(query.data).T
+        if hits:
+            scores = scores + keyword_matrix[:, hits] @ sp.csr_matrix(_KEYWORD_WEIGHTS[hits]).T
+        scores = scores.tocsc()
+        scores.sum_duplicates()
+        rows, values = scores.indices, scores.data
+
+        top_k = min(top_k, len(values))
+        if top_k <= 0:
+            return []
+        top = np.argpartition(-values, top_k - 1)[:top_k]
+        top = top[np.argsort(-values[top])]
+
+        results = []
+        for j in top:
+            if values[j] <= 0:
+                break
+            i = rows[j]
+            results.append({
+                'score': float(values[j]),
+                'id': int(corpus.ids[i]),
+                'url': corpus.urls[i],
+                'title': corpus.titles[i],
+                'text': corpus.contents[i],
+                'content_type': corpus.types[i]
+            })
+        return results
+
+
+# Global search index instance
+search_index = SearchIndex()
 
 
 def simple_search(question: str, top_k: int = 5) -> List[Dict]:
     """
-    Simple text-based search through scraped content using basic keyword matching.
+    Text-based search through scraped content using the TF-IDF search index.
     """
     try:
-        # Get all content from database
-        contents = ScrapedContent.query.all()
-        
-        if not contents:
-            return []
-        
-        # Simple keyword matching
-        question_words = set(question.lower().split())
-        scored_results = []
-        
-        for content in contents:
-            # Combine title and content for scoring
-            text = f"{content.title} {content.content}".lower()
-            
-            # Enhanced keyword matching for evaluation questions
-            score = 0
-            
-            # Exact phrase matching (highest priority)
-            if "gpt-3.5-turbo" in question.lower() and "gpt-3.5-turbo" in text:
-                score += 20
-            if "gpt-4o-mini" in question.lower() and "gpt-4o-mini" in text:
-                score += 15
-            if "ga4" in question.lower() and "ga4" in text:
-                score += 20
-            if "dashboard" in question.lower() and "dashboard" in text:
-                score += 15
-            if "bonus" in question.lower() and "bonus" in text:
-                score += 15
-            if "docker" in question.lower() and "docker" in text:
-                score += 20
-            if "podman" in question.lower() and "podman" in text:
-                score += 20
-            if "sep 2025" in question.lower() and "sep 2025" in text:
-                score += 20
-            if "exam" in question.lower() and "exam" in text:
-                score += 15
-            
-            # Individual word matching
-            for word in question_words:
-                if len(word) > 2:  # Skip very short words
-                    score += text.count(word)
-            
-            if score > 0:
-                scored_results.append({
-                    'content': content,
-                    'score': score,
-                    'id': content.id,
-                    'url': content.url,
-                    'title': content.title,
-                    'text': content.content,
-                    'content_type': content.content_type
-                })
-        
-        # Sort by score and return top results
-        scored_results.sort(key=lambda x: x['score'], reverse=True)
-        return scored_results[:top_k]
-        
+        return search_index.search(question, top_k)
     except Exception as e:
         logger.error(f"Error in simple search: {e}")
         return []
 
 
+def answer_cache_key(question: str, image_base64: str = None) -> str:
+    """
+    Hash a question and optional image into the key used by the answer caches.
+    The newest indexed document id is part of the key, so scraping new content
+    invalidates every cached answer.
+    """
+    corpus_version = search_index.corpus.last_id
+    return hashlib.sha256(
+        f"{corpus_version}:{question.strip().lower()}{image_base64 or ''}".encode()
+    ).hexdigest()
+
+
+def _remember_answer(key: str, result: Dict[str, Any], cached_at: datetime):
+    with _answer_cache_lock:
+        _answer_cache[key] = (cached_at, result)
+        _answer_cache.move_to_end(key)
+        while len(_answer_cache) > ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+
+
+def get_cached_answer(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up an answer in the in-process cache, then in the database.
+    Answers older than ANSWER_CACHE_TTL are treated as missing.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=ANSWER_CACHE_TTL)
+    with _answer_cache_lock:
+        entry = _answer_cache.get(key)
+        if entry is not None:
+            cached_at, result = entry
+            if cached_at > cutoff:
+                _answer_cache.move_to_end(key)
+                return result
+            del _answer_cache[key]
+
+    try:
+        record = db.session.get(CachedAnswer, key)
+    except Exception as e:
+        logger.error(f"Error reading cached answer: {e}")
+        return None
+
+    if record is None or record.created_at <= cutoff:
+        return None
+
+    result = record.payload
+    _remember_answer(key, result, record.created_at)
+    return result
+
+
+def cache_answer(key: str, result: Dict[str, Any]):
+    """
+    Store an answer in the in-process cache and persist it to the database,
+    dropping persisted answers that have expired.
+    """
+    now = datetime.utcnow()
+    _remember_answer(key, result, now)
+    try:
+        db.session.merge(CachedAnswer(hash=key, payload=result, created_at=now))
+        CachedAnswer.query.filter(
+            CachedAnswer.created_at <= now - timedelta(seconds=ANSWER_CACHE_TTL)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error saving cached answer: {e}")
+
+
 def generate_fallback_answer(question: str, image_base64: str = None) -> Dict[str, Any]:
     """
     Generate a fallback answer using only search results when AI is unavailable.
@@ -130,44 +387,31 @@ def generate_fallback_answer(question: str, image_base64: str = None) -> Dict[st
         }
 
 
-def answer_question(question: str, image_base64: str = None) -> Dict[str, Any]:
+def _prepare_messages(question: str, image_base64: str = None) -> Tuple[List[Dict], List[Dict]]:
     """
-    Answer a student question using simple search and OpenAI.
+    Search for context and build the OpenAI messages and candidate links for a question.
     """
-    if not openai_client:
-        return generate_fallback_answer(question, image_base64)
+    # Search for relevant content
+    search_results = simple_search(question, top_k=5)
     
-    try:
-        # Search for relevant content
-        search_results = simple_search(question, top_k=5)
-        
-        # Prepare context from search results
-        context_parts = []
-        relevant_links = []
-        
-        for result in search_results:
-            if result['score'] > 0:  # Only include results with some relevance
-                context_parts.append(f"Title: {result['title']}\nURL: {result['url']}\nContent: {result['text'][:500]}...")
-                relevant_links.append({
-                    "url": result['url'],
-                    "text": result['title']
-                })
-        
-        context = "\n\n---\n\n".join(context_parts) if context_parts else "No highly relevant content found in the database."
-        
-        # Prepare user message content
-        user_text = f"""Student Question: {question}
+    # Prepare context from search results
+    relevant_results = [result for result in search_results if result['score'] > 0]  # Only include results with some relevance
+    context = build_context(relevant_results, content_key='text') or "No highly relevant content found in the database."
+    relevant_links = [{"url": result['url'], "text": result['title']} for result in relevant_results]
+    
+    # Prepare user message content
+    user_text = f"""Student Question: {question}
 
 Relevant Course Content and Discussions:
 {context}
 
 Please provide a helpful answer to the student's question based on the above context."""
-        
-        # Prepare messages for OpenAI
-        messages = [
-            {
-                "role": "system", 
-                "content": """You are a helpful Teaching Assistant for the Tools in Data Science course at IIT Madras. 
+    
+    # Prepare messages for OpenAI
+    messages = [
+        {
+            "role": "system", 
+            "content": """You are a helpful Teaching Assistant for the Tools in Data Science course at IIT Madras. 
 
 Your task is to answer student questions based on the provided course content and discourse discussions.
 
@@ -179,32 +423,64 @@ Guidelines:
 5. Focus on practical, actionable advice for students
 
 Respond with a clear, helpful answer that addresses the student's question directly."""
-            }
-        ]
-        
-        # Add image support if provided
-        if image_base64:
-            user_text += "\n\nNote: The student has also provided an image/screenshot. Please analyze it in context of their question."
-            messages.append({
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": user_text
-                    },
-                    {
-                        "type": "image_url", 
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
-                        }
+        }
+    ]
+    
+    # Add image support if provided
+    if image_base64:
+        user_text += "\n\nNote: The student has also provided an image/screenshot. Please analyze it in context of their question."
+        messages.append({
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": user_text
+                },
+                {
+                    "type": "image_url", 
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{image_base64}"
                     }
-                ]
-            })
-        else:
-            messages.append({
-                "role": "user",
-                "content": user_text
-            })
+                }
+            ]
+        })
+    else:
+        messages.append({
+            "role": "user",
+            "content": user_text
+        })
+    
+    return messages, relevant_links
+
+
+def _error_answer(question: str, image_base64: str, error: Exception) -> Dict[str, Any]:
+    logger.error(f"Error answering question: {error}")
+    # Fallback to simple search-based answer if AI fails
+    if "quota" in str(error).lower() or "insufficient" in str(error).lower():
+        return generate_fallback_answer(question, image_base64)
+    return {
+        "answer": f"Sorry, I encountered an error while processing your question: {str(error)}",
+        "links": []
+    }
+
+
+def answer_question(question: str, image_base64: str = None) -> Dict[str, Any]:
+    """
+    Answer a student question using simple search and OpenAI.
+    """
+    if not openai_client:
+        return generate_fallback_answer(question, image_base64)
+    
+    cache_key = answer_cache_key(question, image_base64)
+    cached = get_cached_answer(cache_key)
+    if cached is not None:
+        return dict(cached)
+    
+    try:
+        messages, relevant_links = _prepare_messages(question, image_base64)
+        
+        # Score links against the question up front so only the answer check runs after generation
+        scored_links = score_links(relevant_links, question)
         
         # Get response from OpenAI
         response = openai_client.chat.completions.create(
@@ -217,65 +493,77 @@ Respond with a clear, helpful answer that addresses the student's question direc
         answer = response.choices[0].message.content or "I couldn't generate a response."
         
         # Filter and rank links based on relevance
-        final_links = rank_and_filter_links(relevant_links, question, answer)
+        final_links = filter_scored_links(scored_links, answer)
         
-        return {
+        result = {
             "answer": answer,
             "links": final_links[:3]  # Return top 3 most relevant links
         }
+        cache_answer(cache_key, result)
+        return dict(result)
         
     except Exception as e:
-        logger.error(f"Error answering question: {e}")
-        # Fallback to simple search-based answer if AI fails
-        if "quota" in str(e).lower() or "insufficient" in str(e).lower():
-            return generate_fallback_answer(question, image_base64)
-        return {
-            "answer": f"Sorry, I encountered an error while processing your question: {str(e)}",
-            "links": []
-        }
+        return _error_answer(question, image_base64, e)
 
 
-def rank_and_filter_links(links: List[Dict], question: str, answer: str) -> List[Dict]:
+def stream_answer(question: str, image_base64: str = None) -> Iterator[Dict[str, Any]]:
     """
-    Rank and filter links based on relevance to the question and answer.
+    Answer a student question, yielding {"delta": text} events as the answer is
+    generated and a final {"answer", "links"} event once it is complete.
     """
-    if not links:
-        return []
+    if not openai_client:
+        yield generate_fallback_answer(question, image_base64)
+        return
     
-    # Simple ranking based on keyword matching
-    question_lower = question.lower()
-    answer_lower = answer.lower()
+    cache_key = answer_cache_key(question, image_base64)
+    cached = get_cached_answer(cache_key)
+    if cached is not None:
+        yield dict(cached)
+        return
     
-    scored_links = []
-    for link in links:
-        score = 0
-        title_lower = link['text'].lower()
+    try:
+        messages, relevant_links = _prepare_messages(question, image_base64)
+        
+        # Score links against the question up front so only the answer check runs after generation
+        scored_links = score_links(relevant_links, question)
+        
+        stream = openai_client.chat.completions.create(
+            model="gpt-4o",  # the newest OpenAI model is "gpt-4o"
+            messages=messages,
+            max_tokens=1000,
+            temperature=0.1,
+            stream=True
+        )
         
-        # Score based on title relevance
-        question_words = question_lower.split()
-        for word in question_words:
-            if len(word) > 3 and word in title_lower:
-                score += 1
+        answer_parts = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                answer_parts.append(delta)
+                yield {"delta": delta}
         
-        # Check if link is mentioned in answer
-        if link['url'] in answer or link['text'].lower() in answer_lower:
-            score += 2
+        answer = "".join(answer_parts) or "I couldn't generate a response."
+        final_links = filter_scored_links(scored_links, answer)
         
-        scored_links.append((link, score))
-    
-    # Sort by score and return
-    scored_links.sort(key=lambda x: x[1], reverse=True)
-    return [link for link, score in scored_links if score > 0]
+        result = {
+            "answer": answer,
+            "links": final_links[:3]  # Return top 3 most relevant links
+        }
+        cache_answer(cache_key, result)
+        yield dict(result)
+        
+    except Exception as e:
+        yield _error_answer(question, image_base64, e)
 
 
 def initialize_simple_data():
     """
-    Initialize the database with sample data if needed.
+    Build the search index over the scraped content.
     """
     try:
-        # Import and run the scraped data initialization
-        from scraper import initialize_scraped_data
-        initialize_scraped_data()
+        search_index.build()
         logger.info("Simple data initialization completed")
     except Exception as e:
         logger.error(f"Error initializing simple data: {e}")
\ No newline at end of file
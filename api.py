@@ -1,9 +1,9 @@
-from flask import Blueprint, request, jsonify
-import base64
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+import re
+import threading
 import time
-import json
 import logging
-from ai_assistant_simple import answer_question, initialize_simple_data
+from ai_assistant_simple import answer_question, stream_answer, initialize_simple_data
 from scraper import initialize_scraped_data
 from app import db
 from models import QuestionAnswer
@@ -12,9 +12,35 @@ logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
-# Initialize on first import
-initialize_scraped_data()
-initialize_simple_data()
+# Characters allowed in base64 image data, whitespace included for line-wrapped
+# payloads; only this prefix is checked, the image itself is never decoded here
+BASE64_CHARS_RE = re.compile(r"[A-Za-z0-9+/=\s]*")
+BASE64_PREFIX_LENGTH = 4096
+
+# Sample data and the search index are set up once per process, on the first
+# request or from the Gunicorn master when the app is preloaded
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def initialize_data():
+    """
+    Seed sample content and build the search index, once per process.
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        initialize_scraped_data()
+        initialize_simple_data()
+        _initialized = True
+
+
+@api_bp.before_app_request
+def ensure_initialized():
+    initialize_data()
 
 
 @api_bp.route('/', methods=['POST'])
@@ -26,6 +52,8 @@ def handle_question():
         "question": "What model should I use?",
         "image": "base64_encoded_image_data"  # optional
     }
+    Clients sending "Accept: text/event-stream" get the answer streamed as
+    server-sent events instead of a single JSON response.
     """
     start_time = time.time()
     
@@ -46,38 +74,26 @@ def handle_question():
         image_base64 = data.get('image')
         
         # Validate image if provided
-        if image_base64:
-            try:
-                # Validate base64 format
-                base64.b64decode(image_base64)
-            except Exception:
-                return jsonify({
-                    "error": "Invalid base64 image data"
-                }), 400
+        if image_base64 and not is_valid_base64(image_base64):
+            return jsonify({
+                "error": "Invalid base64 image data"
+            }), 400
         
         logger.info(f"Processing question: {question[:100]}...")
         
+        if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+            return Response(
+                stream_with_context(stream_answer_events(question, image_base64, start_time)),
+                mimetype='text/event-stream'
+            )
+        
         # Get answer from AI assistant
         result = answer_question(question, image_base64)
         
         # Calculate response time
         response_time = time.time() - start_time
         
-        # Store in database for analytics
-        try:
-            qa_record = QuestionAnswer(
-                question=question,
-                answer=result['answer'],
-                links=json.dumps(result['links']),
-                has_image=bool(image_base64),
-                response_time=response_time
-            )
-            db.session.add(qa_record)
-            db.session.commit()
-        except Exception as e:
-            logger.error(f"Error saving to database: {e}")
-        
-        logger.info(f"Question answered in {response_time:.2f} seconds")
+        save_question_answer(question, image_base64, result, response_time)
         
         return jsonify(result)
         
@@ -90,6 +106,51 @@ def handle_question():
         }), 500
 
 
+def is_valid_base64(data):
+    """
+    Cheap structural check that data looks like base64, without decoding it.
+    The image is sent on as a base64 data URL, so a corrupt payload is still
+    rejected by the model API rather than costing a full decode on every request.
+    """
+    return isinstance(data, str) and BASE64_CHARS_RE.fullmatch(data, 0, BASE64_PREFIX_LENGTH) is not None
+
+
+def stream_answer_events(question, image_base64, start_time):
+    """
+    Relay answer deltas as server-sent events, then send the final answer and links.
+    """
+    result = None
+    for event in stream_answer(question, image_base64):
+        if 'delta' in event:
+            yield f"data: {current_app.json.dumps({'delta': event['delta']})}\n\n"
+        else:
+            result = event
+    
+    yield f"event: done\ndata: {current_app.json.dumps(result)}\n\n"
+    
+    save_question_answer(question, image_base64, result, time.time() - start_time)
+
+
+def save_question_answer(question, image_base64, result, response_time):
+    """
+    Store an answered question in the database for analytics.
+    """
+    try:
+        qa_record = QuestionAnswer(
+            question=question,
+            answer=result['answer'],
+            links=result['links'],
+            has_image=bool(image_base64),
+            response_time=response_time
+        )
+        db.session.add(qa_record)
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error saving to database: {e}")
+    
+    logger.info(f"Question answered in {response_time:.2f} seconds")
+
+
 @api_bp.route('/health', methods=['GET'])
 def health_check():
     """
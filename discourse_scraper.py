@@ -9,6 +9,8 @@ Usage:
 """
 
 import argparse
+import asyncio
+import aiohttp
 import requests
 from datetime import datetime, timedelta
 import time
@@ -20,17 +22,37 @@ from app import app, db
 from models import ScrapedContent
 import trafilatura
 
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MAX_CONCURRENT_REQUESTS = 8  # Topic requests in flight at once
+REQUEST_DELAY = 0.25  # Seconds each request slot waits before being released
+BATCH_SIZE = 200  # Scraped rows saved per database commit
+USE_SELECTOLAX = LexborHTMLParser is not None  # Set False to parse posts with BeautifulSoup
+
+
+def html_to_text(html):
+    """
+    Convert a post's cooked HTML to newline-separated plain text.
+    """
+    if USE_SELECTOLAX:
+        return LexborHTMLParser(html).text(separator='\n', strip=True)
+    return BeautifulSoup(html, 'html.parser').get_text(separator='\n', strip=True)
+
 
 class DiscourseScrapperTDS:
     def __init__(self, base_url="https://discourse.onlinedegree.iitm.ac.in"):
         self.base_url = base_url
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'TDS-Virtual-TA-Bot/1.0 (Educational Purpose)'
-        })
+        }
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
         
     def get_category_topics(self, category_id, start_date=None, end_date=None):
         """
@@ -96,30 +118,56 @@ class DiscourseScrapperTDS:
             if response.status_code != 200:
                 return None
                 
-            data = response.json()
-            posts = data.get('post_stream', {}).get('posts', [])
-            
-            # Combine all posts in the topic
-            content_parts = []
-            topic_title = data.get('title', 'Untitled')
-            
-            for post in posts:
-                if post.get('cooked'):  # HTML content
-                    # Convert HTML to clean text
-                    soup = BeautifulSoup(post['cooked'], 'html.parser')
-                    text_content = soup.get_text(separator='\n', strip=True)
-                    content_parts.append(text_content)
-            
-            return {
-                'title': topic_title,
-                'content': '\n\n---\n\n'.join(content_parts),
-                'url': f"{self.base_url}/t/{topic_id}"
-            }
+            return self._parse_topic(topic_id, response.json())
             
         except Exception as e:
             logger.error(f"Error fetching topic {topic_id}: {e}")
             return None
     
+    async def _fetch_topic(self, session, semaphore, topic_id):
+        """
+        Fetch full content of a topic/post without blocking other requests.
+        """
+        async with semaphore:
+            try:
+                url = f"{self.base_url}/t/{topic_id}.json"
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    if response.status != 200:
+                        return None
+                    data = await response.json()
+            except Exception as e:
+                logger.error(f"Error fetching topic {topic_id}: {e}")
+                return None
+            finally:
+                await asyncio.sleep(REQUEST_DELAY)  # Rate limiting
+        
+        return self._parse_topic(topic_id, data)
+    
+    async def _fetch_topics(self, topic_ids):
+        """
+        Fetch several topics concurrently, bounded by MAX_CONCURRENT_REQUESTS.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async with aiohttp.ClientSession(headers=self.headers) as session:
+            tasks = [self._fetch_topic(session, semaphore, topic_id) for topic_id in topic_ids]
+            return await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def _parse_topic(self, topic_id, data):
+        """
+        Convert a topic JSON payload into title, content and URL.
+        """
+        posts = data.get('post_stream', {}).get('posts', [])
+        
+        # Combine all posts in the topic, converting HTML content to clean text
+        content_parts = [html_to_text(post['cooked']) for post in posts if post.get('cooked')]
+        topic_title = data.get('title', 'Untitled')
+        
+        return {
+            'title': topic_title,
+            'content': '\n\n---\n\n'.join(content_parts),
+            'url': f"{self.base_url}/t/{topic_id}"
+        }
+    
     def scrape_tds_course_posts(self, category_url=None, start_date=None, end_date=None):
         """
         Main scraping function for TDS course posts.
@@ -137,44 +185,82 @@ class DiscourseScrapperTDS:
             topics = self.get_category_topics(category_id, start_date, end_date)
             logger.info(f"Found {len(topics)} topics to scrape")
             
-            scraped_count = 0
+            # Load every known topic URL once instead of querying per topic; a set is
+            # exact and small enough that a bloom filter would not save anything
+            topic_prefix = f"{self.base_url}/t/"
+            existing_urls = {
+                url for (url,) in db.session.query(ScrapedContent.url)
+                .filter(ScrapedContent.url.startswith(topic_prefix, autoescape=True))
+            }
+            
+            topic_ids = []
             for topic in topics:
-                try:
-                    topic_id = topic['id']
-                    topic_url = f"{self.base_url}/t/{topic_id}"
-                    
-                    # Check if already scraped
-                    existing = ScrapedContent.query.filter_by(url=topic_url).first()
-                    if existing:
-                        logger.info(f"Topic {topic_id} already scraped, skipping")
-                        continue
-                    
-                    # Get full topic content
-                    topic_data = self.get_topic_content(topic_id)
-                    
-                    if topic_data:
-                        # Save to database
-                        scraped_content = ScrapedContent(
-                            url=topic_data['url'],
-                            title=topic_data['title'],
-                            content=topic_data['content'],
-                            content_type='discourse'
-                        )
-                        
-                        db.session.add(scraped_content)
-                        db.session.commit()
-                        
-                        scraped_count += 1
-                        logger.info(f"Scraped topic: {topic_data['title']}")
-                    
-                    time.sleep(2)  # Rate limiting
-                    
-                except Exception as e:
-                    logger.error(f"Error processing topic {topic.get('id', 'unknown')}: {e}")
+                topic_id = topic['id']
+                topic_url = f"{topic_prefix}{topic_id}"
+                
+                # Check if already scraped
+                if topic_url in existing_urls:
+                    logger.debug(f"Topic {topic_id} already scraped, skipping")
+                    continue
+                
+                # Also drops a topic listed on two category pages in this run
+                existing_urls.add(topic_url)
+                topic_ids.append(topic_id)
+            
+            # Get full topic content
+            results = asyncio.run(self._fetch_topics(topic_ids))
+            
+            scraped_count = 0
+            failed_count = 0
+            batch = []
+            for topic_id, topic_data in zip(topic_ids, results):
+                if isinstance(topic_data, Exception):
+                    logger.error(f"Error processing topic {topic_id}: {topic_data}")
+                    failed_count += 1
                     continue
+                
+                if topic_data:
+                    batch.append(ScrapedContent(
+                        url=topic_data['url'],
+                        title=topic_data['title'],
+                        content=topic_data['content'],
+                        content_type='discourse'
+                    ))
+                    logger.debug(f"Scraped topic: {topic_data['title']}")
+                else:
+                    failed_count += 1
+                
+                if len(batch) >= BATCH_SIZE:
+                    scraped_count += self._save_batch(batch)
+            
+            scraped_count += self._save_batch(batch)
+            
+            # One summary line per crawl; per-topic progress is only logged at DEBUG
+            logger.info(
+                f"Scraping completed. {scraped_count} new topics added to database "
+                f"(skipped={len(topics) - len(topic_ids)} failed={failed_count})"
+            )
             
-            logger.info(f"Scraping completed. {scraped_count} new topics added to database.")
             return scraped_count
+    
+    def _save_batch(self, batch):
+        """
+        Insert a batch of scraped rows in one transaction and empty the batch.
+        Returns the number of rows saved.
+        """
+        if not batch:
+            return 0
+        
+        try:
+            db.session.bulk_save_objects(batch)
+            db.session.commit()
+            return len(batch)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving {len(batch)} scraped topics: {e}")
+            return 0
+        finally:
+            batch.clear()
 
 
 def parse_date(date_string):
@@ -0,0 +1,20 @@
+"""
+Gunicorn settings: load the app and its search index once in the master
+process so forked workers share the memory copy-on-write.
+"""
+
+preload_app = True
+
+
+def when_ready(server):
+    from api import initialize_data
+    initialize_data()
+
+
+def post_fork(server, worker):
+    # Connections opened by the master must not be shared across workers. The
+    # worker gets a fresh pool; close=False leaves the inherited connections
+    # alone so closing them here cannot end the master's sessions
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -19,10 +19,19 @@ class QuestionAnswer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text, nullable=False)
-    links = db.Column(db.Text)  # JSON string of links
+    links = db.Column(db.JSON)  # List of {url, text} links
     has_image = db.Column(db.Boolean, default=False)
     response_time = db.Column(db.Float)  # Response time in seconds
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<QuestionAnswer {self.id}>'
+
+
+class CachedAnswer(db.Model):
+    hash = db.Column(db.String(64), primary_key=True)  # sha256 of question and image
+    payload = db.Column(db.JSON, nullable=False)  # Answer and links
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CachedAnswer {self.hash[:12]}>'
@@ -1,3 +1,11 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+from collections import defaultdict
+import aiohttp
+from aiohttp_client_cache import CachedSession, SQLiteBackend
 import trafilatura
 import requests
 from bs4 import BeautifulSoup
@@ -7,21 +15,202 @@ import logging
 from app import app, db
 from models import ScrapedContent
 
+try:
+    from resiliparse.extract.html2text import extract_plain_text
+except ImportError:
+    extract_plain_text = None
+
 logger = logging.getLogger(__name__)
 
+MAX_CONCURRENT_REQUESTS = 5  # Page requests in flight at once
+HOST_DELAY_RANGE = (1, 3)  # Random seconds between two requests to the same host
+HTTP_CACHE_FILE = 'http_cache.sqlite'  # Downloaded pages, so re-runs do not refetch them
+HTTP_CACHE_EXPIRE = 86400  # Seconds a cached page stays fresh
+SCRAPER_STATE_FILE = 'scraper_state.jsonl'  # One line per saved URL, so restarts skip them without a DB query
+HEADERS = {
+    'User-Agent': 'TDS-Virtual-TA-Bot/1.0 (Educational Purpose)'
+}
+
+
+def extract_text(html: str) -> str:
+    """
+    Extract the main text of an HTML page, using resiliparse and falling back to trafilatura.
+    """
+    if extract_plain_text is not None:
+        try:
+            # Keep line breaks so extract_title_from_content can pick out the first line
+            text = extract_plain_text(html, main_content=True)
+            if text:
+                return text
+        except Exception as e:
+            logger.warning(f"resiliparse extraction failed, falling back to trafilatura: {e}")
+    return trafilatura.extract(html) or ""
+
 
 def get_website_text_content(url: str) -> str:
     """
-    Extract clean text content from a website using trafilatura.
+    Extract clean text content from a website.
+    """
+    content = asyncio.run(fetch_page_texts([url]))[0]
+    if isinstance(content, Exception):
+        logger.error(f"Error extracting content from {url}: {content}")
+        return ""
+    return content
+
+
+class HostThrottle:
+    """
+    Space out requests to each host by a random delay while different hosts proceed in parallel.
+    """
+    def __init__(self, delay_range=HOST_DELAY_RANGE):
+        self.delay_range = delay_range
+        self.locks = defaultdict(asyncio.Lock)
+        self.last_request = {}
+    
+    async def wait(self, url: str):
+        """
+        Sleep until the host of url may be requested again and claim the slot.
+        """
+        host = urlparse(url).netloc
+        async with self.locks[host]:
+            if host in self.last_request:
+                ready_at = self.last_request[host] + random.uniform(*self.delay_range)
+                await asyncio.sleep(max(0, ready_at - time.monotonic()))
+            self.last_request[host] = time.monotonic()
+
+
+async def fetch_page_text(session, semaphore, throttle, url: str) -> str:
+    """
+    Download a page without blocking other requests and extract its text off the event loop.
     """
+    # Be respectful with scraping; cached pages are not requested from the host
+    if not await session.cache.has_url(url):
+        await throttle.wait(url)
+    async with semaphore:
+        try:
+            logger.debug(f"Scraping: {url}")
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status != 200:
+                    return ""
+                html = await response.text()
+        except Exception as e:
+            logger.error(f"Error extracting content from {url}: {e}")
+            return ""
+    
+    return await asyncio.to_thread(extract_text, html)
+
+
+async def fetch_page_texts(urls):
+    """
+    Fetch several pages concurrently, bounded by MAX_CONCURRENT_REQUESTS and per-host politeness.
+    Responses are cached in HTTP_CACHE_FILE.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    throttle = HostThrottle()
+    cache = SQLiteBackend(HTTP_CACHE_FILE, expire_after=HTTP_CACHE_EXPIRE)
+    async with CachedSession(cache=cache, headers=HEADERS) as session:
+        tasks = [fetch_page_text(session, semaphore, throttle, url) for url in urls]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def load_scraper_state(path: str = SCRAPER_STATE_FILE) -> set:
+    """
+    URLs recorded in the scraper checkpoint by earlier crawls.
+    """
+    urls = set()
+    if not os.path.exists(path):
+        return urls
     try:
-        downloaded = trafilatura.fetch_url(url)
-        if downloaded:
-            text = trafilatura.extract(downloaded)
-            return text or ""
+        with open(path) as f:
+            for line in f:
+                urls.add(json.loads(line)['url'])
     except Exception as e:
-        logger.error(f"Error extracting content from {url}: {e}")
-    return ""
+        # A crash can leave a partially written last line
+        logger.error(f"Error reading scraper checkpoint, using {len(urls)} URLs: {e}")
+    return urls
+
+
+def append_scraper_state(rows, path: str = SCRAPER_STATE_FILE):
+    """
+    Record saved pages in the scraper checkpoint.
+    """
+    with open(path, 'a') as f:
+        for row in rows:
+            entry = {
+                'url': row.url,
+                'ts': time.time(),
+                'hash': hashlib.sha256(row.content.encode('utf-8')).hexdigest()
+            }
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+
+
+def scrape_urls(urls, content_type: str):
+    """
+    Scrape the given URLs concurrently and save any that are not already stored.
+    """
+    # URLs in the checkpoint need no lookup; the rest are checked in one query.
+    # Delete SCRAPER_STATE_FILE after rebuilding the database to rescrape everything.
+    seen_urls = load_scraper_state()
+    unknown_urls = [url for url in urls if url not in seen_urls]
+    if unknown_urls:
+        seen_urls.update(
+            url for (url,) in db.session.query(ScrapedContent.url).filter(ScrapedContent.url.in_(unknown_urls))
+        )
+    
+    new_urls = []
+    for url in urls:
+        if url in seen_urls:
+            logger.debug(f"Already scraped: {url}")
+            continue
+        # Also drops repeats of a URL within this run
+        seen_urls.add(url)
+        new_urls.append(url)
+    
+    contents = asyncio.run(fetch_page_texts(new_urls))
+    
+    rows = []
+    failed = 0
+    for url, content in zip(new_urls, contents):
+        if isinstance(content, Exception):
+            logger.error(f"Error scraping {url}: {content}")
+            failed += 1
+            continue
+        
+        if not content:
+            failed += 1
+            continue
+        
+        # Extract title from content or URL
+        title = extract_title_from_content(content) or url.split('/')[-1]
+        
+        rows.append(ScrapedContent(
+            url=url,
+            title=title,
+            content=content,
+            content_type=content_type
+        ))
+    
+    # One summary line per crawl; per-URL progress is only logged at DEBUG
+    logger.info(f"Crawl complete: scraped={len(rows)} skipped={len(urls) - len(new_urls)} failed={failed}")
+    if not rows:
+        return
+    
+    # Insert every page in one transaction instead of committing per row
+    try:
+        db.session.bulk_save_objects(rows)
+        db.session.commit()
+        logger.info(f"Saved {len(rows)} pages of {content_type} content")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error saving {len(rows)} scraped pages: {e}")
+        return
+    
+    # Only committed pages are checkpointed
+    try:
+        append_scraper_state(rows)
+    except OSError as e:
+        logger.error(f"Error writing scraper checkpoint: {e}")
 
 
 def scrape_discourse_posts(base_url="https://discourse.onlinedegree.iitm.ac.in", 
@@ -39,37 +228,9 @@ def scrape_discourse_posts(base_url="https://discourse.onlinedegree.iitm.ac.in",
             f"{base_url}/t/assignment-guidelines/5678",
         ]
         
-        for url in sample_urls:
-            try:
-                logger.info(f"Scraping: {url}")
-                
-                # Check if already scraped
-                existing = ScrapedContent.query.filter_by(url=url).first()
-                if existing:
-                    logger.info(f"Already scraped: {url}")
-                    continue
-                
-                content = get_website_text_content(url)
-                if content:
-                    # Extract title from content or URL
-                    title = extract_title_from_content(content) or url.split('/')[-1]
-                    
-                    scraped_content = ScrapedContent(
-                        url=url,
-                        title=title,
-                        content=content,
-                        content_type='discourse'
-                    )
-                    
-                    db.session.add(scraped_content)
-                    db.session.commit()
-                    logger.info(f"Saved content from: {url}")
-                
-                # Be respectful with scraping
-                time.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Error scraping {url}: {e}")
+        scrape_urls(sample_urls, 'discourse')
+
+        refresh_search_index()
 
 
 def scrape_course_content():
@@ -85,46 +246,37 @@ def scrape_course_content():
             "https://onlinedegree.iitm.ac.in/course/tools-in-data-science/assignments",
         ]
         
-        for url in course_urls:
-            try:
-                logger.info(f"Scraping course content: {url}")
-                
-                # Check if already scraped
-                existing = ScrapedContent.query.filter_by(url=url).first()
-                if existing:
-                    logger.info(f"Already scraped: {url}")
-                    continue
-                
-                content = get_website_text_content(url)
-                if content:
-                    title = extract_title_from_content(content) or url.split('/')[-1]
-                    
-                    scraped_content = ScrapedContent(
-                        url=url,
-                        title=title,
-                        content=content,
-                        content_type='course'
-                    )
-                    
-                    db.session.add(scraped_content)
-                    db.session.commit()
-                    logger.info(f"Saved course content from: {url}")
-                
-                time.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Error scraping course content {url}: {e}")
+        scrape_urls(course_urls, 'course')
+
+        refresh_search_index()
+
+
+def refresh_search_index():
+    """
+    Pick up newly committed rows in the in-memory search index.
+    """
+    try:
+        # Imported here because ai_assistant_simple imports this module on startup
+        from ai_assistant_simple import search_index
+        search_index.refresh()
+    except Exception as e:
+        logger.error(f"Error refreshing search index: {e}")
 
 
 def extract_title_from_content(content: str) -> str:
     """
     Extract a title from the content text.
     """
-    lines = content.split('\n')
-    for line in lines:
-        line = line.strip()
+    # Walk the lines with str.find (a memchr scan) instead of splitting the whole text
+    start = 0
+    while start < len(content):
+        end = content.find('\n', start)
+        if end < 0:
+            end = len(content)
+        line = content[start:end].strip()
         if line and len(line) < 100:  # Reasonable title length
             return line
+        start = end + 1
     return "Untitled"
 
 
@@ -232,14 +384,6 @@ Check the official course portal regularly for exam date announcements.""",
             }
         ]
         
-        for item in sample_contents:
-            content = ScrapedContent(
-                url=item["url"],
-                title=item["title"],
-                content=item["content"],
-                content_type=item["content_type"]
-            )
-            db.session.add(content)
-        
+        db.session.bulk_insert_mappings(ScrapedContent, sample_contents)
         db.session.commit()
         logger.info("Initialized database with sample scraped content")
@@ -0,0 +1,80 @@
+import io
+import os
+import re
+import logging
+from typing import List, Dict, Tuple
+import httpx
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
+# do not change this unless explicitly requested by the user
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+if not OPENAI_API_KEY:
+    logger.warning("OPENAI_API_KEY not found in environment variables")
+
+# One keep-alive HTTP/2 connection pool shared by every OpenAI call in the process
+shared_http = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    timeout=60
+) if OPENAI_API_KEY else None
+
+openai_client = OpenAI(api_key=OPENAI_API_KEY, http_client=shared_http) if OPENAI_API_KEY else None
+
+# Words keep inner dots and dashes so model names like gpt-3.5-turbo stay whole
+WORD_RE = re.compile(r"[\w.-]+")
+URL_RE = re.compile(r"https?://[^\s<>()\[\]\"'`]+")
+
+CONTEXT_SNIPPET_CHARS = 500  # Characters of each document included in the prompt
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+
+def _words(text: str) -> set:
+    return {word.strip('.-') for word in WORD_RE.findall(text.lower())}
+
+
+def build_context(docs: List[Dict], content_key: str = 'content') -> str:
+    """
+    Write the title, URL and truncated content of each document into one prompt context string.
+    """
+    buf = io.StringIO()
+    for i, doc in enumerate(docs):
+        if i:
+            buf.write(CONTEXT_SEPARATOR)
+        buf.write("Title: ")
+        buf.write(doc['title'])
+        buf.write("\nURL: ")
+        buf.write(doc['url'])
+        buf.write("\nContent: ")
+        buf.write(doc[content_key][:CONTEXT_SNIPPET_CHARS])
+        buf.write("...")
+    return buf.getvalue()
+
+
+def score_links(links: List[Dict], question: str) -> List[Tuple[Dict, int]]:
+    """
+    Score links by how many question keywords appear in their titles.
+    """
+    question_words = {word for word in _words(question) if len(word) > 3}
+    return [(link, len(question_words & _words(link['text']))) for link in links]
+
+
+def filter_scored_links(scored_links: List[Tuple[Dict, int]], answer: str) -> List[Dict]:
+    """
+    Boost links the answer mentions, then drop unscored links and sort by score.
+    """
+    answer_lower = answer.lower()
+    answer_urls = {url.rstrip('.,;:!?') for url in URL_RE.findall(answer)}
+    
+    ranked = []
+    for link, score in scored_links:
+        # Check if link is mentioned in answer
+        if link['url'] in answer_urls or link['text'].lower() in answer_lower:
+            score += 2
+        ranked.append((link, score))
+    
+    # Sort by score and return
+    ranked.sort(key=lambda x: x[1], reverse=True)
+    return [link for link, score in ranked if score > 0]
@@ -1,38 +1,175 @@
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+import atexit
+import json
 import pickle
+import hashlib
 import os
 import logging
+import threading
+from collections import OrderedDict
+from functools import cached_property, lru_cache
 from typing import List, Tuple
 from app import app
 from models import ScrapedContent
 
 logger = logging.getLogger(__name__)
 
+# IVF256,PQ32x8 needs ~39 training vectors per centroid, so smaller corpora
+# stay on an HNSW graph or, below HNSW_MIN_DOCS, an exhaustive index
+IVF_MIN_DOCS = 10000
+IVF_NPROBE = 8
+HNSW_MIN_DOCS = 1000
+HNSW_EF_SEARCH = 64
+
+# Exhaustive and HNSW indexes store 8-bit scalar-quantized embeddings (a quarter
+# of the float32 size; FAISS scores them with SIMD int8 kernels). Per-dimension
+# ranges are learned from the corpus each time an index is built and widened by
+# this fraction on each side, so documents added before the next rebuild are
+# rarely clipped.
+SQ_RANGE_MARGIN = 0.2
+# Smaller corpora are too few to learn ranges from and are stored as float16
+# (half the float32 size, nothing to train)
+SQ8_MIN_DOCS = 256
+
+# Added documents are written to disk in bulk once this many are pending; until
+# then each one is appended to a JSONL log that is replayed after a crash
+FLUSH_THRESHOLD = 32
+
+# Saved indexes are memory-mapped read-only so the kernel pages vectors in on
+# demand and shares them between gunicorn workers. IO_FLAG_MMAP_IFC (newer
+# FAISS) also maps flat and scalar-quantized codes; plain IO_FLAG_MMAP only
+# maps IVF lists. A mapped index is reloaded into memory before it is modified.
+INDEX_MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def index_description(num_docs: int) -> str:
+    """
+    Pick the FAISS index factory string for a corpus of the given size.
+    Vectors are keyed by ScrapedContent.id: IVF stores ids in its inverted lists,
+    every other index is wrapped in an IDMap2. An IDMap2 around IVF would keep
+    IVF's sequence numbers while compacting its id map on removal, mixing up ids.
+    """
+    if num_docs >= IVF_MIN_DOCS:
+        return "IVF256,PQ32x8"
+    if num_docs >= HNSW_MIN_DOCS:
+        return "IDMap2,HNSW32,SQ8"
+    if num_docs >= SQ8_MIN_DOCS:
+        return "IDMap2,SQ8"
+    if num_docs > 0:
+        return "IDMap2,SQfp16"
+    return "IDMap2,Flat"  # Placeholder until the first documents are added
+
+
+EMBED_BATCH_SIZE = 64  # Texts per forward pass when encoding
+QUERY_CACHE_SIZE = 256  # Query embeddings kept so repeated questions skip the encoder
+# Document embeddings kept (in memory and in embedding_cache.pkl) for texts seen
+# recently; a full float32 copy of the corpus would undo the SQ8/PQ savings
+EMBEDDING_CACHE_SIZE = 2048
+
+# Loaded SentenceTransformer models by name, shared by every VectorStore
+_MODEL_CACHE = {}
+_model_lock = threading.Lock()
+
+
+def embedding_device() -> str:
+    """
+    Pick the fastest available torch device for the embedding model.
+    """
+    import torch
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def unwrap_index(index):
+    """
+    The index doing the search, without its IDMap2 wrapper if it has one.
+    """
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def load_model(model_name: str):
+    """
+    Load a SentenceTransformer model once per process and reuse it afterwards.
+    """
+    with _model_lock:
+        if model_name not in _MODEL_CACHE:
+            # Imported here so importing this module does not pull in torch
+            from sentence_transformers import SentenceTransformer
+            device = embedding_device()
+            logger.info(f"Loading embedding model {model_name} on {device}")
+            _MODEL_CACHE[model_name] = SentenceTransformer(model_name, device=device)
+        return _MODEL_CACHE[model_name]
+
+
+def document_text(content: ScrapedContent) -> str:
+    """
+    Text embedded for a scraped row; the title is included for better search.
+    """
+    return f"{content.title}\n{content.content}"
+
+
+def document_dict(content: ScrapedContent) -> dict:
+    """
+    Search result fields for a scraped row.
+    """
+    return {
+        'id': content.id,
+        'url': content.url,
+        'title': content.title,
+        'content': content.content,
+        'content_type': content.content_type
+    }
+
 
 class VectorStore:
     def __init__(self, model_name='all-MiniLM-L6-v2'):
         """
         Initialize vector store with a lightweight sentence transformer model.
         """
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
         self.dimension = 384  # Dimension for all-MiniLM-L6-v2
-        self.index = None
-        self.documents = []
+        self.index = None  # IndexIDMap2 or IndexIVF keyed by ScrapedContent.id
+        self._index_mapped = False  # True while self.index is a read-only view of index_file
+        self.doc_ids = np.empty(0, dtype=np.int64)  # Index position -> ScrapedContent.id, read from the index
         self.index_file = 'vector_index.faiss'
-        self.docs_file = 'documents.pkl'
+        self.embedding_cache = None  # sha256 of document text -> normalized embedding, least recently used first
+        self.embedding_cache_file = 'embedding_cache.pkl'
+        self.log_file = 'documents_log.jsonl'  # Ids of documents added since the last flush
+        self.flush_threshold = FLUSH_THRESHOLD
+        self._dirty_count = 0
+        self._query_cache = OrderedDict()  # Exact query string -> embedding, least recently used first
+        self._query_cache_lock = threading.Lock()
+        atexit.register(self.flush)
         
+    @cached_property
+    def model(self):
+        """
+        Embedding model, loaded on first use.
+        """
+        return load_model(self.model_name)
+    
     def load_or_create_index(self):
         """
         Load existing index or create new one from database content.
         """
-        if os.path.exists(self.index_file) and os.path.exists(self.docs_file):
+        if os.path.exists(self.index_file):
             try:
-                self.index = faiss.read_index(self.index_file)
-                with open(self.docs_file, 'rb') as f:
-                    self.documents = pickle.load(f)
+                self.index = self._read_index()
+                if isinstance(self.index, faiss.IndexIDMap2):
+                    if isinstance(self._base_index(), faiss.IndexIVF):
+                        raise ValueError("IVF index wrapped in an IDMap2 loses ids on removal")
+                elif not isinstance(self.index, faiss.IndexIVF):
+                    raise ValueError("index does not store document ids")
+                self._configure_index(self.index)
+                self._sync_doc_ids()
                 logger.info("Loaded existing vector index")
+                self._replay_log()
                 return
             except Exception as e:
                 logger.error(f"Error loading index: {e}")
@@ -40,107 +177,369 @@ class VectorStore:
         # Create new index
         self.create_index()
     
+    def _read_index(self):
+        """
+        Memory-map the saved index, falling back to reading it into memory.
+        """
+        try:
+            index = faiss.read_index(self.index_file, INDEX_MMAP_FLAGS)
+            self._index_mapped = True
+            return index
+        except RuntimeError as e:
+            logger.info(f"Reading vector index into memory, mmap not supported: {e}")
+        self._index_mapped = False
+        return faiss.read_index(self.index_file)
+    
+    def _ensure_writable(self):
+        """
+        Replace a memory-mapped index with an in-memory copy before modifying it.
+        """
+        if not self._index_mapped:
+            return
+        self.index = faiss.read_index(self.index_file)
+        self._index_mapped = False
+        self._configure_index(self.index)
+    
     def create_index(self):
         """
         Create vector index from scraped content in database.
         """
+        self._index_mapped = False
         with app.app_context():
             contents = ScrapedContent.query.all()
             
             if not contents:
                 logger.warning("No scraped content found in database")
                 # Create empty index
-                self.index = faiss.IndexFlatIP(self.dimension)
-                self.documents = []
+                self.index = faiss.index_factory(self.dimension, index_description(0), faiss.METRIC_INNER_PRODUCT)
+                self._sync_doc_ids()
                 return
             
-            # Prepare documents
-            texts = []
-            self.documents = []
-            
-            for content in contents:
-                # Combine title and content for better search
-                text = f"{content.title}\n{content.content}"
-                texts.append(text)
-                
-                self.documents.append({
-                    'id': content.id,
-                    'url': content.url,
-                    'title': content.title,
-                    'content': content.content,
-                    'content_type': content.content_type,
-                    'text': text
-                })
-            
-            # Generate embeddings
-            logger.info(f"Generating embeddings for {len(texts)} documents")
-            embeddings = self.model.encode(texts, convert_to_tensor=False)
-            embeddings = np.array(embeddings).astype('float32')
+            ids = np.array([content.id for content in contents], dtype=np.int64)
             
-            # Normalize for cosine similarity
-            faiss.normalize_L2(embeddings)
+            # Generate embeddings; the title+content strings only live for the encode
+            embeddings = self._embed_documents([document_text(content) for content in contents])
             
             # Create FAISS index
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.index.add(embeddings)
+            self.index = self._build_index(embeddings, ids)
+            self._sync_doc_ids()
+            
+            self._save_index()
             
-            # Save index and documents
-            faiss.write_index(self.index, self.index_file)
-            with open(self.docs_file, 'wb') as f:
-                pickle.dump(self.documents, f)
+            logger.info(f"Created vector index with {len(ids)} documents")
+
+    def _save_index(self):
+        """
+        Save index and the embedding cache to disk.
+        """
+        # Write then rename: other workers may still have the old file mapped,
+        # and truncating it in place would crash them
+        tmp_file = f"{self.index_file}.tmp"
+        faiss.write_index(self.index, tmp_file)
+        os.replace(tmp_file, self.index_file)
+        if self.embedding_cache is not None:
+            self._save_embedding_cache()
+        
+        # Everything in the log is now part of the saved index
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self._dirty_count = 0
+    
+    def flush(self):
+        """
+        Write pending document additions to disk.
+        """
+        if self._dirty_count and self.index is not None:
+            self._save_index()
+            logger.info("Flushed vector index to disk")
+    
+    def _replay_log(self):
+        """
+        Re-add documents that were logged but not flushed before the last shutdown.
+        """
+        if not os.path.exists(self.log_file):
+            return
+        
+        indexed_ids = set(self.doc_ids.tolist())
+        ids = []
+        try:
+            with open(self.log_file) as f:
+                for line in f:
+                    doc_id = json.loads(line)['id']
+                    if doc_id not in indexed_ids:
+                        indexed_ids.add(doc_id)
+                        ids.append(doc_id)
+        except Exception as e:
+            # A crash can leave a partially written last line
+            logger.error(f"Error reading document log, replaying {len(ids)} documents: {e}")
+        
+        if ids:
+            with app.app_context():
+                contents = ScrapedContent.query.filter(ScrapedContent.id.in_(ids)).all()
+            self._add_embedded(contents)
+            self._dirty_count = len(contents)
+            logger.info(f"Replayed {len(contents)} unflushed documents from {self.log_file}")
+    
+    def _sync_doc_ids(self):
+        if isinstance(self.index, faiss.IndexIDMap2):
+            self.doc_ids = faiss.vector_to_array(self.index.id_map).astype(np.int64, copy=False)
+            return
+        # IVF keeps the ids in its inverted lists, in list order
+        invlists = self.index.invlists
+        ids = [
+            faiss.rev_swig_ptr(invlists.get_ids(list_no), invlists.list_size(list_no)).copy()
+            for list_no in range(self.index.nlist) if invlists.list_size(list_no)
+        ]
+        self.doc_ids = np.concatenate(ids).astype(np.int64, copy=False) if ids else np.empty(0, dtype=np.int64)
+    
+    def _base_index(self):
+        """
+        The index without its IDMap2 wrapper; inside an IDMap2 it is addressed by position rather than id.
+        """
+        return unwrap_index(self.index)
+    
+    def _embed_documents(self, texts: List[str]) -> np.ndarray:
+        """
+        Generate normalized embeddings, reusing cached ones for unchanged texts.
+        """
+        if self.embedding_cache is None:
+            self._load_embedding_cache()
+        
+        keys = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.embedding_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                embeddings[i] = cached
+                self.embedding_cache.move_to_end(key)
+        
+        if missing:
+            logger.info(f"Generating embeddings for {len(missing)} of {len(texts)} documents")
+            encoded = self._encode([texts[i] for i in missing])
+            embeddings[missing] = encoded
             
-            logger.info(f"Created vector index with {len(texts)} documents")
+            # Only the newest EMBEDDING_CACHE_SIZE survive, so skip copying the rest
+            for i, embedding in zip(missing[-EMBEDDING_CACHE_SIZE:], encoded[-EMBEDDING_CACHE_SIZE:]):
+                self.embedding_cache[keys[i]] = embedding.copy()
+        
+        while len(self.embedding_cache) > EMBEDDING_CACHE_SIZE:
+            self.embedding_cache.popitem(last=False)
+        
+        return embeddings
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts in batches into unit-length float32 embeddings for cosine similarity.
+        """
+        embeddings = self.model.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        # FAISS needs C-contiguous float32; this is a no-op for what encode returns
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Embed queries, encoding only those not in the query cache.
+        """
+        with self._query_cache_lock:
+            cached = [self._query_cache.get(query) for query in queries]
+            for query, embedding in zip(queries, cached):
+                if embedding is not None:
+                    self._query_cache.move_to_end(query)
+        
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        if missing:
+            embeddings = self._encode([queries[i] for i in missing])
+            with self._query_cache_lock:
+                for i, embedding in zip(missing, embeddings):
+                    cached[i] = embedding
+                    self._query_cache[queries[i]] = embedding
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+        
+        return np.stack(cached)
+    
+    def _load_embedding_cache(self):
+        self.embedding_cache = OrderedDict()
+        if os.path.exists(self.embedding_cache_file):
+            try:
+                with open(self.embedding_cache_file, 'rb') as f:
+                    self.embedding_cache = OrderedDict(pickle.load(f))
+            except Exception as e:
+                logger.error(f"Error loading embedding cache: {e}")
+    
+    def _save_embedding_cache(self):
+        with open(self.embedding_cache_file, 'wb') as f:
+            pickle.dump(self.embedding_cache, f)
+    
+    def _build_index(self, embeddings: np.ndarray, ids: np.ndarray):
+        """
+        Build an inner-product index sized for the corpus from normalized embeddings and their document ids.
+        """
+        description = index_description(len(embeddings))
+        index = faiss.index_factory(self.dimension, description, faiss.METRIC_INNER_PRODUCT)
+        base = unwrap_index(index)
+        sq_index = faiss.downcast_index(base.storage) if isinstance(base, faiss.IndexHNSW) else base
+        if isinstance(sq_index, faiss.IndexScalarQuantizer):
+            sq_index.sq.rangestat = faiss.ScalarQuantizer.RS_minmax
+            sq_index.sq.rangestat_arg = SQ_RANGE_MARGIN
+        if not index.is_trained:
+            logger.info(f"Training {description} index on {len(embeddings)} vectors")
+            index.train(embeddings)
+        index.add_with_ids(embeddings, ids)
+        self._configure_index(index)
+        return index
+
+    @staticmethod
+    def _configure_index(index):
+        """
+        Apply search-time parameters that are not stored with the index.
+        """
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = IVF_NPROBE
+        base = unwrap_index(index)
+        if isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = HNSW_EF_SEARCH
     
     def search(self, query: str, top_k: int = 5) -> List[Tuple[dict, float]]:
         """
         Search for similar documents using vector similarity.
         """
-        if self.index is None or len(self.documents) == 0:
+        ids, scores = self.search_batch([query], top_k)
+        if ids.size == 0:
             return []
         
-        # Generate query embedding
-        query_embedding = self.model.encode([query], convert_to_tensor=False)
-        query_embedding = np.array(query_embedding).astype('float32')
-        faiss.normalize_L2(query_embedding)
+        valid = ids[0] != -1
+        hit_ids = ids[0][valid].tolist()
+        
+        # Resolve every hit with one query instead of keeping a copy of the corpus in memory
+        with app.app_context():
+            contents = ScrapedContent.query.filter(ScrapedContent.id.in_(hit_ids)).all()
+        documents = {content.id: document_dict(content) for content in contents}
         
-        # Search
-        scores, indices = self.index.search(query_embedding, min(top_k, len(self.documents)))
+        # Rows deleted since they were indexed are skipped
+        return [(documents[doc_id], float(score))
+                for doc_id, score in zip(hit_ids, scores[0][valid]) if doc_id in documents]
+    
+    def search_batch(self, queries: List[str], top_k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search for several queries at once.
+        Returns (ids, scores) arrays of shape (len(queries), k) holding ScrapedContent ids,
+        best first; ids are -1 where fewer than k documents were found.
+        """
+        if not queries or self.index is None or len(self.doc_ids) == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
         
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx != -1:  # Valid index
-                results.append((self.documents[idx], float(score)))
+        # Encode every uncached query in one batch and search them all in one FAISS call
+        query_embeddings = self._embed_queries(queries)
         
-        return results
+        k = min(top_k, len(self.doc_ids))
+        scores, ids = self.index.search(query_embeddings, k)
+        return ids, scores
     
     def add_document(self, content: ScrapedContent):
         """
         Add a new document to the index.
         """
+        self.add_documents([content])
+    
+    def add_documents(self, contents: List[ScrapedContent]) -> int:
+        """
+        Embed new documents in one batch and add them to the index.
+        They are logged immediately and written to the index files once
+        flush_threshold documents are pending. Returns the number of documents added.
+        """
         if self.index is None:
             self.load_or_create_index()
         
-        text = f"{content.title}\n{content.content}"
-        embedding = self.model.encode([text], convert_to_tensor=False)
-        embedding = np.array(embedding).astype('float32')
-        faiss.normalize_L2(embedding)
+        # A freshly built index already contains every row in the database
+        indexed_ids = set(self.doc_ids.tolist())
+        contents = [content for content in contents if content.id not in indexed_ids]
+        if not contents:
+            return 0
+        
+        self._add_embedded(contents)
+        
+        with open(self.log_file, 'a') as f:
+            for content in contents:
+                f.write(json.dumps({'id': content.id}) + '\n')
+        
+        self._dirty_count += len(contents)
+        if self._dirty_count >= self.flush_threshold:
+            self.flush()
+        
+        logger.info(f"Added {len(contents)} documents to vector index")
+        return len(contents)
+    
+    def _add_embedded(self, contents: List[ScrapedContent]):
+        """
+        Embed scraped rows and append them to the in-memory index.
+        """
+        embeddings = self._embed_documents([document_text(content) for content in contents])
+        ids = np.array([content.id for content in contents], dtype=np.int64)
+        
+        # Index types only change upwards, so removals never force a rebuild here
+        total = self.index.ntotal + len(contents)
+        base = self._base_index()
+        is_fp16 = isinstance(base, faiss.IndexScalarQuantizer) and base.sq.qtype == faiss.ScalarQuantizer.QT_fp16
+        reaches_sq8 = total >= SQ8_MIN_DOCS and is_fp16
+        reaches_hnsw = total >= HNSW_MIN_DOCS and not isinstance(base, (faiss.IndexHNSW, faiss.IndexIVF))
+        reaches_ivf = total >= IVF_MIN_DOCS and not isinstance(base, faiss.IndexIVF)
+        
+        if self.index.ntotal == 0 or reaches_sq8 or reaches_hnsw or reaches_ivf:
+            # Rebuild as the index type for the new corpus size (this also replaces
+            # the empty placeholder and relearns SQ8 ranges); indexed vectors are
+            # decoded from their stored codes
+            if self.index.ntotal:
+                logger.info(f"Rebuilding vector index as {index_description(total)} for {total} documents")
+                embeddings = np.vstack([base.reconstruct_n(0, self.index.ntotal), embeddings])
+                ids = np.concatenate([self.doc_ids, ids])
+            self.index = self._build_index(embeddings, ids)
+            self._index_mapped = False
+            self._sync_doc_ids()
+        else:
+            self._ensure_writable()
+            self.index.add_with_ids(embeddings, ids)
+            self._sync_doc_ids()
+    
+    def remove_documents(self, ids: List[int]) -> int:
+        """
+        Remove documents from the index by ScrapedContent.id and save it.
+        Returns the number of documents removed.
+        """
+        if self.index is None:
+            self.load_or_create_index()
         
-        self.index.add(embedding)
+        keep = ~np.isin(self.doc_ids, np.asarray(ids, dtype=np.int64))
+        removed = int(len(keep) - keep.sum())
+        if not removed:
+            return 0
         
-        self.documents.append({
-            'id': content.id,
-            'url': content.url,
-            'title': content.title,
-            'content': content.content,
-            'content_type': content.content_type,
-            'text': text
-        })
+        self._ensure_writable()
+        try:
+            self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        except RuntimeError:
+            # HNSW graphs cannot drop vectors, so rebuild from the ones that are kept
+            logger.info(f"Rebuilding vector index to remove {removed} documents")
+            embeddings = self._base_index().reconstruct_n(0, self.index.ntotal)[keep]
+            self.index = self._build_index(embeddings, self.doc_ids[keep])
         
-        # Save updated index
-        faiss.write_index(self.index, self.index_file)
-        with open(self.docs_file, 'wb') as f:
-            pickle.dump(self.documents, f)
+        self._sync_doc_ids()
+        self._save_index()
+        logger.info(f"Removed {removed} documents from vector index")
+        return removed
 
 
-# Global vector store instance
-vector_store = VectorStore()
+@lru_cache(maxsize=1)
+def get_vector_store() -> VectorStore:
+    """
+    Shared vector store instance, created on first use.
+    """
+    return VectorStore()